@@ -1,5 +1,14 @@
-import datetime, itertools, os, random, re, json
+import datetime, itertools, os, random, re, json, zipfile, posixpath, hashlib
+try:
+	import xml.etree.cElementTree as ET
+except ImportError:
+	import xml.etree.ElementTree as ET
+from xml.sax.saxutils import quoteattr
 from dateutil import parser
+try:
+	import numpy as np
+except ImportError:
+	np = None
 
 class _InputError(Exception):
 	def __init__(self, value):
@@ -13,6 +22,21 @@ class _NotFoundError(Exception):
 	def __str__(self):
 		return repr(self.value)
 				
+def _cell_value(values, row, col):
+	"""
+	values	: None or dict
+	row		: int
+	col		: int
+	return	: value
+	method	: hidden
+	
+	Returns the value of the cell at row and col on the active sheet, or in values
+	(a dict of (row, col) keys and cell values read from file) if it is passed.
+	"""
+	if values is None:
+		return Cell(row, col).value
+	return values.get((row, col))
+				
 class Columns:
 	def __init__(self, column_values):
 		"""
@@ -27,25 +51,41 @@ class Columns:
 		
 		Available Methods: \n
 		get_values: get columns values at specific point on active sheet.
+		get_headers: get column values at specific point renamed as headers.
 		compare_all_columns: compare column values at specific points on all sheets.
 		"""
 		if not all([isinstance(elem, int) for elem in column_values]):
 			raise _InputError("List may only contain integers")
 		self.column_values = column_values
 		
-	def get_values(self, row):
+	def get_values(self, row, values = None):
 		"""
 		row	: int
+		values	: None or dict
 		return	: list
 		method	: visible
 		
 		Returns list of lowered stripped string values found in each cell referenced
-		by row and each column integer in column_values on active sheet.
+		by row and each column integer in column_values on active sheet, or in 
+		values (a dict of (row, col) keys and cell values read from file) if passed.
 		"""
-		values_list = [str(Cell(row, col).value).lower().strip() 
+		values_list = [str(_cell_value(values, row, col)).lower().strip() 
 					   for col in self.column_values]
 		return values_list
 		
+	def get_headers(self, row, values = None):
+		"""
+		row	: int
+		values	: None or dict
+		return	: list
+		method	: visible
+		
+		Returns list of the values get_values() would return after the cells had 
+		been renamed by __rename_headers, without writing anything to the sheet.
+		"""
+		return ['_'.join(str(_cell_value(values, row, col)).strip().lower().split())
+				for col in self.column_values]
+		
 	def __compare_values(self, master_list, sheet_list):
 		"""
 		master_list : list
@@ -101,9 +141,11 @@ class Columns:
 				Cell(start_row, col).value = header_val[0]
 		return
 				
-	def compare_all_columns(self, start_row_dict):
+	def compare_all_columns(self, start_row_dict, workbook_path = None, executor = None):
 		"""
 		start_row_dict	: dict
+		workbook_path	: None or string
+		executor		: None or object with a map method
 		return		: dict
 		method		: visible
 		
@@ -114,13 +156,36 @@ class Columns:
 		renames by calling __rename_headers before being compared.\n
 		All values are created by calling get_values(), and the arguments to that 
 		function are supplied by getting the start row from the start_row_dict and 
-		the self.column_values object.
+		the self.column_values object.\n
+		If the path of the saved .xlsx workbook is passed as workbook_path, the 
+		sheets are read from file and the headers are compared using get_headers()
+		without being renamed on the sheets. If an executor is also passed (e.g. a 
+		multiprocessing.pool.ThreadPool or multiprocessing.Pool) the sheets are read
+		and processed concurrently by executor.map().
 		"""
-		sheets = all_sheets()
 		if not all([isinstance(value, int) 
 				    for key, value in start_row_dict.iteritems()]):
 			raise _InputError("All values in dictionary must be integers")
+		if workbook_path or executor:
+			if not isinstance(workbook_path, str):
+				raise _InputError("workbook_path must be a string when reading sheets from file")
+			missing_sheets = [sheet for sheet in _xlsx_reader(workbook_path).sheet_names
+							  if sheet not in start_row_dict]
+			if missing_sheets:
+				raise _InputError("start_row_dict has no start row for sheets: {}".format(
+								  ', '.join(missing_sheets)))
+			results = _map_sheets(self, 'get_headers', workbook_path, executor,
+								  {sheet : (row,) for sheet, row in start_row_dict.iteritems()},
+								  max(start_row_dict.values()))
+			disparity_dict = {sheet : [] for sheet, found, sheet_list in results}
+			master_list = results[0][2]
+			for sheet, found, sheet_list in results[1:]:
+				sheet_disparities = self.__compare_values(master_list, sheet_list)
+				if sheet_disparities:
+					disparity_dict[sheet].extend(sheet_disparities)
+			return disparity_dict
 			
+		sheets = all_sheets()
 		disparity_dict = {sheet : [] for sheet in sheets} 
 		active_sheet(sheets[0])
 		self.__rename_headers(start_row_dict[sheets[0]])
@@ -152,11 +217,14 @@ class Dates:
 
 		Available Methods \n
 		get_value	: get value of date cell on active sheet
+		get_type	: get type of value in date cell on active sheet
+		get_types	: get type of value in date cell on all sheets
 		cell_to_date	: get datetime object string in date cell on active sheet
 		check_all_dates	: check dates on all sheets convertible to datetime objects
 		find_duplicates	: find duplicate dates on sheets in workbook
 		relative_order	: check date implied order equals order of sheets
 		discontinuities	: identify when dates imply large discontinuities
+		business_discontinuities : identify missing working days between sheets
 		"""
 		if not isinstance(date_cell_ref, tuple) or\
 		not all(isinstance(elem, int) for elem in date_cell_ref) or\
@@ -178,63 +246,86 @@ class Dates:
 		self.separator = separator
 		self.index_pos = index_pos
 		
-	def __get_value(self):
+	def get_value(self, values = None):
 		"""
+		values	: None or dict
 		return	: string
 		method	: visible
 		
 		Returns string value at cell referenced by self.date_cell_ref on active 
-		sheet.
+		sheet, or in values (a dict of (row, col) keys and cell values read from 
+		file) if passed.
 		"""
 		if not self.strp_format:
-			return Cell(self.date_cell_ref).value
+			return _cell_value(values, *self.date_cell_ref)
 		else:
-			return str(Cell(self.date_cell_ref).value)
+			return str(_cell_value(values, *self.date_cell_ref))
+			
+	def get_type(self, values = None):
+		"""
+		values	: None or dict
+		return	: type
+		method	: visible
+		
+		Returns type of value found at self.date_cell_ref on active sheet, or in 
+		values if passed.
+		"""
+		return type(_cell_value(values, *self.date_cell_ref))
 			
-	def get_types(self):
+	def get_types(self, workbook_path = None, executor = None):
 		"""
+		workbook_path	: None or string
+		executor		: None or object with a map method
 		return	: dict
 		method	: visible
 		
-		Returns dict of sheet names and type of value found at self.date_cell_ref
+		Returns dict of sheet names and type of value found at self.date_cell_ref.
+		If the path of the saved .xlsx workbook is passed as workbook_path the 
+		sheets are read from file, concurrently by executor.map() if an executor
+		is also passed.
 		"""
+		if workbook_path or executor:
+			return {sheet : value_type for sheet, found, value_type in 
+					_map_sheets(self, 'get_type', workbook_path, executor,
+								max_row = self.date_cell_ref[0])}
 		sheets = all_sheets()
 		type_dict = {sheet : object() for sheet in sheets}
 		for sheet in sheets:
 			active_sheet(sheet)
-			type_dict[sheet] = type(Cell(self.date_cell_ref).value)
+			type_dict[sheet] = self.get_type()
 		return type_dict
 
-	def cell_to_date(self):
+	def cell_to_date(self, values = None):
 		"""
+		values	: None or dict
 		return	: datetime.datetime or None
 		method	: visible
 
 		Returns datetime object of value of self.get_value() formatted according to
-		strp_format on active sheet. If separator is specified self.get_value() is
-		split and the value at index position index_pos is formatted according to
-		strp_format and returned.\n
+		strp_format on active sheet, or in values if passed. If separator is 
+		specified self.get_value() is split and the value at index position 
+		index_pos is formatted according to	strp_format and returned.\n
 		Returns None if format to datetime object not possible.
 		"""
 
 		if not self.strp_format:
-			date_object = self.__get_value()
+			date_object = self.get_value(values)
 			if isinstance(date_object, datetime.datetime):
 				return date_object.date()
 			else:
 				return None
 		if not self.separator:
 			try:
-				date_object = datetime.datetime.strptime(self.__get_value(), self.strp_format)
+				date_object = datetime.datetime.strptime(self.get_value(values), self.strp_format)
 				return date_object.date()
 			except ValueError:
 				return None
 		else:
 			try:
-				stripped_string = self.__get_value().split(self.separator)[self.index_pos]
+				stripped_string = self.get_value(values).split(self.separator)[self.index_pos]
 				date_object = datetime.datetime.strptime(stripped_string, self.strp_format)
 				return date_object.date()
-			except ValueError:
+			except (ValueError, IndexError):
 				return None
 
 	def __update_date_dict(self, date_object, date_dict):
@@ -251,15 +342,25 @@ class Dates:
 			date_dict[active_sheet()] = 'Date not found on this sheet'
 			return
 
-	def check_all_dates(self):
+	def check_all_dates(self, workbook_path = None, executor = None):
 		"""
+		workbook_path	: None or string
+		executor		: None or object with a map method
 		return	: dict
 		method	: visible
 
 		Returns dict of sheet keys and values that are datetime objects created by
 		calling	cell_to_date() with arguments passed in intialisation call. If no
-		datetime object is created a string message to user is the key value.
+		datetime object is created a string message to user is the key value.\n
+		If the path of the saved .xlsx workbook is passed as workbook_path the 
+		sheets are read from file, concurrently by executor.map() if an executor
+		is also passed.
 		"""
+		if workbook_path or executor:
+			return {sheet : date_object or 'Date not found on this sheet'
+					for sheet, found, date_object in 
+					_map_sheets(self, 'cell_to_date', workbook_path, executor,
+								max_row = self.date_cell_ref[0])}
 		sheets = all_sheets()
 		date_dict = {sheet : object() for sheet in sheets}
 		for sheet in sheets:
@@ -353,12 +454,80 @@ class Dates:
 								   if value > datetime.timedelta(discontinuity_value)]
 		return [(sheets[x-1], sheets[x]) for x in unusual_discontinuities]
 
+	def business_discontinuities(self, weekmask = '1111011', holidays = None,
+								 discontinuity_value = 0):
+		"""
+		weekmask	: string
+		holidays	: None or list of datetime.date
+		discontinuity_value : int
+		return		: list of tuples
+		method		: visible
+
+		Returns list of tuples where each tuple is a pair of contiguous sheets 
+		whose dates are separated by more than discontinuity_value missing working
+		days, followed by a list of those missing working days as datetime.date 
+		objects.\n
+		Working days are defined by weekmask, a string of seven 1s (open) and 0s 
+		(closed) beginning with Monday, and the holidays list. By default the 
+		factory is closed on Fridays only. The gaps between all contiguous sheets
+		are counted in a single numpy.busday_count() call.\n
+		A date_dict is created by calling check_all_dates(). Requires numpy.
+		"""
+		if np is None:
+			raise _InputError("numpy must be installed to use business_discontinuities")
+		if not isinstance(discontinuity_value, int):
+			raise _InputError("Argument 'discontinuity_value' must be an integer")
+		sheets = all_sheets()
+		date_dict = self.check_all_dates()
+		date_list = [date_dict[sheet] for sheet in sheets]
+		if not all(isinstance(date, datetime.date) for date in date_list):
+			raise _InputError("""All date_cell_ref values in all sheets must be capable
+								of being datetime objects before running this function.
+								Use the check_all_dates() method to perform checks""")
+		calendar = np.busdaycalendar(weekmask = weekmask, holidays = holidays or [])
+		dates = np.array(date_list, dtype = 'datetime64[D]')
+		day_after = dates[:-1] + 1
+		working_gaps = np.busday_count(day_after, dates[1:], busdaycal = calendar)
+		business_discontinuities = []
+		for x in np.flatnonzero(working_gaps > discontinuity_value):
+			gap_days = np.arange(day_after[x], dates[x + 1], dtype = 'datetime64[D]')
+			missing_days = gap_days[np.is_busday(gap_days, busdaycal = calendar)]
+			business_discontinuities.append((sheets[x], sheets[x + 1], 
+											 missing_days.tolist()))
+		return business_discontinuities
+
+		
+	def __file_date(self, filename, re_compiler, strp_format = None):
+		"""
+		filename	: string
+		re_compiler	: compiled regular expression
+		strp_format	: None or string
+		return		: tuple
+		method		: hidden
 		
-	def compare_cell_file_date(self, file_list_dict, regex, strp_format = None):
+		Returns tuple of the date string identified in filename by re_compiler and
+		the datetime.date object that string converts to. If strp_format is passed
+		it is used with datetime.strptime(), otherwise dateutil.parser is used.\n
+		Raises _NotFoundError if re_compiler does not match filename, and ValueError
+		if the conversion to a datetime.date object is not possible.
+		"""
+		result = re_compiler.search(filename)
+		if not result:
+			raise _NotFoundError("No date match in file")
+		date_group = result.group()
+		if strp_format:
+			d_date = datetime.datetime.strptime(date_group, strp_format).date()
+		else:
+			d_date = parser.parse(date_group, fuzzy=True, dayfirst = True).date()
+		return date_group, d_date
+		
+	def compare_cell_file_date(self, file_list_dict, regex, strp_format = None, 
+							   provenance_dict = None):
 		"""
 		file_list_dict 	: dict (as created when compiling)
 		regex			: str
 		strp_format		: None or string
+		provenance_dict	: None or dict (as created when compiling)
 		return			: dict
 		method			: visible
 		
@@ -380,52 +549,150 @@ class Dates:
 		we use dateutil.parser.parse in the code by default. If that is giving
 		perverse results, then by all means pass an strp_format argument.\n
 		The user is notified in the dictionary if any conversions are impossible, or
-		the regular expression does not identify a date like string in the filelists.
+		the regular expression does not identify a date like string in the filelists.\n
 		
-		Assumes that the sheets are in same order as file list i.e. no changes have
-		been made. 
+		If a provenance_dict (the sheet_compiler.provenance_dict attribute, or the
+		'provenance_dict_<date>.json' saved when compiling) is passed, each sheet is 
+		matched directly to the file it was copied from, so the result is correct
+		even if sheets have been reordered, or some files failed to compile. Sheets
+		with no provenance entry, and files in file_list_dict that were never 
+		compiled, are reported in the dictionary.\n
+		Without a provenance_dict, assumes that the sheets are in same order as 
+		file list i.e. no changes have been made. 
 		"""
 		date_dict = self.check_all_dates()
 		sheets = all_sheets()
-		folders = file_list_dict.keys()
-		folders.sort()
 		re_compiler = re.compile(regex)
-		count = 0
 		No_file_match = []
 		Bad_date_conversion = []
 		Mismatches = {}
 		
-		for folder in folders:
-			for file in file_list_dict[folder]:
-				result = re_compiler.search(file)
-				if not result:
+		if provenance_dict:
+			No_provenance = []
+			compiled_files = set((entry['folder'], entry['file']) 
+								 for entry in provenance_dict.itervalues())
+			for sheet in sheets:
+				if sheet not in provenance_dict:
+					No_provenance.append(sheet)
+					continue
+				file = provenance_dict[sheet]['file']
+				try:
+					date_group, d_date = self.__file_date(file, re_compiler, strp_format)
+				except _NotFoundError:
 					No_file_match.append(file)
-					count +=1
 					continue
-				else:
-					date_group = result.group()
-					if strp_format:
-						try:
-							d_date = datetime.datetime.strptime(date_group, strp_format).date()
-						except ValueError:
-							Bad_date_conversion.append(file)
-							count+=1
-							continue
-					else:
-						try:
-							d_date= parser.parse(date_group, fuzzy=True, dayfirst = True).date()
-						except ValueError:
-							Bad_date_conversion.append(file)
-							count+=1
-							continue
+				except ValueError:
+					Bad_date_conversion.append(file)
+					continue
+				if date_dict[sheet] != d_date:
+					Mismatches[sheet] = (date_group, date_dict[sheet])
+			Mismatches.update({
+				"No provenance for sheet:" : No_provenance,
+				"Files not compiled:" : [file for folder in sorted(file_list_dict)
+										 for file in file_list_dict[folder]
+										 if (folder, file) not in compiled_files]})
+		else:
+			folders = file_list_dict.keys()
+			folders.sort()
+			count = 0
+			for folder in folders:
+				for file in file_list_dict[folder]:
+					try:
+						date_group, d_date = self.__file_date(file, re_compiler, strp_format)
+					except _NotFoundError:
+						No_file_match.append(file)
+						count +=1
+						continue
+					except ValueError:
+						Bad_date_conversion.append(file)
+						count+=1
+						continue
 					if date_dict[sheets[count]] != d_date:
 						Mismatches[sheets[count]] = (date_group, date_dict[sheets[count]])
-				count+=1
+					count+=1
 		Mismatches.update({"No date match in file:" : No_file_match, 
 						   "Date conversions not possible" : Bad_date_conversion })
 		return Mismatches
 			
 
+class DateProbe:
+	def __init__(self, candidates):
+		"""
+		candidates	: list of tuples
+		
+		Class for trying many possible Dates settings together when setting up a
+		new workbook. Each candidate is a tuple of the arguments that would be 
+		passed to create a Dates object, i.e. (date_cell_ref[, strp_format, 
+		separator, index_pos]), and is checked by creating that Dates object.\n
+		
+		Initialise class by passing a list of candidate tuples. Every distinct
+		date_cell_ref is read only once per sheet, and every candidate is then 
+		tried against the values read.\n
+		
+		Available Methods\n
+		read_cells		: get values of every candidate date cell on active sheet
+		rank_candidates	: rank candidates by how well they parse on all sheets
+		"""
+		if not isinstance(candidates, list) or not candidates or\
+		not all(isinstance(candidate, tuple) for candidate in candidates):
+			raise _InputError("candidates must be a non-empty list of tuples")
+		self.candidates = candidates
+		self.dates_objects = [Dates(*candidate) for candidate in candidates]
+		self.cell_refs = sorted(set(dates.date_cell_ref for dates in self.dates_objects))
+		
+	def read_cells(self, values = None):
+		"""
+		values	: None or dict
+		return	: dict
+		method	: visible
+		
+		Returns dict of each cell reference in self.cell_refs and the value found 
+		in that cell on the active sheet, or in values (a dict of (row, col) keys 
+		and cell values read from file) if passed.
+		"""
+		return {cell_ref : _cell_value(values, *cell_ref) for cell_ref in self.cell_refs}
+		
+	def rank_candidates(self, workbook_path = None, executor = None):
+		"""
+		workbook_path	: None or string
+		executor		: None or object with a map method
+		return			: list of tuples
+		method			: visible
+		
+		Returns list of tuples of each candidate, the number of sheets on which it
+		creates a datetime.date object, and the share of contiguous pairs of those
+		sheets whose dates increase in sheet order. The list is sorted so that the
+		candidates that parse on the most sheets, and then are most consistent 
+		with the sheet order, come first.\n
+		Every sheet is visited once by calling read_cells(), and each candidate's
+		cell_to_date() is then called on the values read. If the path of the saved
+		.xlsx workbook is passed as workbook_path the sheets are read from file, 
+		concurrently by executor.map() if an executor is also passed.
+		"""
+		if workbook_path or executor:
+			sheet_cells = [cells for sheet, found, cells in
+						   _map_sheets(self, 'read_cells', workbook_path, executor,
+									   max_row = max(row for row, col in self.cell_refs))]
+		else:
+			sheet_cells = []
+			for sheet in all_sheets():
+				active_sheet(sheet)
+				sheet_cells.append(self.read_cells())
+		
+		ranking = []
+		for candidate, dates in zip(self.candidates, self.dates_objects):
+			date_list = [date for date in [dates.cell_to_date(cells) for cells in sheet_cells]
+						 if date]
+			date_pairs = zip(date_list[:-1], date_list[1:])
+			if date_pairs:
+				consistency = sum(1 for before, after in date_pairs 
+								  if after > before) / float(len(date_pairs))
+			else:
+				consistency = 0.0
+			ranking.append((candidate, len(date_list), round(consistency, 3)))
+		ranking.sort(key = lambda x: (x[1], x[2]), reverse = True)
+		return ranking
+
 class FindPoints:
 	def __init__(self, col, start_row, end_value, adjustments = None):
 		"""
@@ -462,20 +729,22 @@ class FindPoints:
 		self.start_row = start_row
 		self.adjustments = adjustments
 
-	def find_point(self):
+	def find_point(self, values = None):
 		"""
+		values	: None or dict
 		return	: int
 		method	: visible
 
 		Returns row of cell where self.end_value is equal to cell referenced by
-		self.col and a row value determined by iteration. Return value is adjusted
-		by an amount as specified by self.adjustments. Raises error if end_value not
-		found. \n
+		self.col and a row value determined by iteration, on the active sheet or in
+		values (a dict of (row, col) keys and cell values read from file) if passed.
+		Return value is adjusted by an amount as specified by self.adjustments. 
+		Raises error if end_value not found. \n
 		Assumes end_value in first 200 rows.
 		"""
 		row = self.start_row
 		while row < 300:
-			if str(Cell(row, self.col).value).strip().lower() == self.end_value:
+			if str(_cell_value(values, row, self.col)).strip().lower() == self.end_value:
 				if self.adjustments:
 					row += self.adjustments
 					return row
@@ -484,14 +753,24 @@ class FindPoints:
 				row +=1
 		raise _NotFoundError("Start row not found")
 
-	def find_all_points(self):
+	def find_all_points(self, workbook_path = None, executor = None):
 		"""
+		workbook_path	: None or string
+		executor		: None or object with a map method
+		return	: dict
 		method : visible
 
 		Returns dict with one key for each sheet in workbook with point row as
 		value. If no point row is found, the key maps to a string value notifying
-		the user of the absence of the point row.
+		the user of the absence of the point row.\n
+		If the path of the saved .xlsx workbook is passed as workbook_path the 
+		sheets are read from file, concurrently by executor.map() if an executor
+		is also passed.
 		"""
+		if workbook_path or executor:
+			return {sheet : point if found else 'Point Not Found'
+					for sheet, found, point in 
+					_map_sheets(self, 'find_point', workbook_path, executor, max_row = 300)}
 		sheets = all_sheets()
 		found_dict = {sheet : object() for sheet in sheets}
 		for sheet in sheets:
@@ -504,6 +783,772 @@ class FindPoints:
 		return found_dict
 
 		
+class DetectPoints:
+	def __init__(self, header_vocabulary = None, end_values = None, max_rows = 300, 
+				 max_cols = 30, header_rows = 40, type_window = 5):
+		"""
+		header_vocabulary	: None or list of strings
+		end_values		: None or list of strings
+		max_rows		: int
+		max_cols		: int
+		header_rows		: int
+		type_window		: int
+		
+		Class for detecting the 'headers' row and the end of the data on every 
+		worksheet without knowing the exact header text, as an alternative to 
+		FindPoints when templates vary between sheets.\n
+		
+		Initialise class by passing an optional list of header values that are 
+		expected to appear in the header row (header_vocabulary) and of values that
+		mark the row after the end of the data (end_values, 'total' by default).
+		Values are compared after being stripped, lowered and joined with '_' in
+		the same way as Columns.compare_all_columns() renames headers. The first 
+		max_rows rows and max_cols columns of each sheet are read, and the first 
+		header_rows rows are scored as possible header rows. Requires numpy.\n
+		
+		Available Methods\n
+		detect_all_points	: get dicts of header rows, end rows and confidence on all sheets
+		"""
+		if np is None:
+			raise _InputError("numpy must be installed to use DetectPoints")
+		for name, value in [('max_rows', max_rows), ('max_cols', max_cols),
+							('header_rows', header_rows), ('type_window', type_window)]:
+			if not isinstance(value, int) or value < 1:
+				raise _InputError("Argument '{}' must be a positive integer".format(name))
+		if header_rows > max_rows:
+			raise _InputError("Argument 'header_rows' may not be greater than 'max_rows'")
+		if not all(isinstance(value, str) for value in
+				   list(header_vocabulary or []) + list(end_values or [])):
+			raise _InputError("header_vocabulary and end_values may only contain strings")
+		
+		self.header_vocabulary = set(self.__normalise(value) for value in header_vocabulary or [])
+		self.end_values = set(self.__normalise(value) for value in end_values or ['total'])
+		self.max_rows = max_rows
+		self.max_cols = max_cols
+		self.header_rows = header_rows
+		self.type_window = type_window
+		
+	def __normalise(self, value):
+		"""
+		value	: string
+		return	: string
+		method	: hidden
+		
+		Returns value stripped, lowered, with words joined by '_' and any trailing
+		':' removed.
+		"""
+		return '_'.join(value.strip().lower().split()).rstrip(':')
+		
+	def __read_block(self):
+		"""
+		return	: list of lists
+		method	: hidden
+		
+		Returns the values in the first self.max_rows rows and self.max_cols 
+		columns of the active sheet, read in a single DataNitro call.
+		"""
+		return CellRange((1, 1), (self.max_rows, self.max_cols)).table
+		
+	def __classify(self, block):
+		"""
+		block	: list of lists
+		return	: tuple of numpy arrays
+		method	: hidden
+		
+		Returns tuple of three arrays of shape (max_rows, max_cols): the kind of 
+		each cell (0 empty, 1 text, 2 number or date), whether the cell is in
+		self.header_vocabulary, and whether the cell is in self.end_values.
+		"""
+		shape = (self.max_rows, self.max_cols)
+		kinds = np.zeros(shape, dtype = np.int8)
+		known = np.zeros(shape, dtype = bool)
+		ends = np.zeros(shape, dtype = bool)
+		for row, values in enumerate(block[:self.max_rows]):
+			for col, value in enumerate(values[:self.max_cols]):
+				if value is None:
+					continue
+				if isinstance(value, (int, long, float, datetime.date, datetime.time)):
+					kinds[row, col] = 2
+					continue
+				text = self.__normalise(value)
+				if not text:
+					continue
+				try:
+					float(text)
+					kinds[row, col] = 2
+					continue
+				except ValueError:
+					kinds[row, col] = 1
+				known[row, col] = text in self.header_vocabulary
+				ends[row, col] = text in self.end_values
+		return kinds, known, ends
+		
+	def __score(self, kinds, known, ends):
+		"""
+		kinds	: numpy array (sheets, max_rows, max_cols)
+		known	: numpy array (sheets, max_rows, max_cols)
+		ends	: numpy array (sheets, max_rows, max_cols)
+		return	: tuple of numpy arrays
+		method	: hidden
+		
+		Scores the first self.header_rows rows of every sheet at once and returns
+		tuple of arrays of the 0 based header row, 0 based last data row, 
+		confidence and best row score of each sheet.\n
+		Each row scores between 0 and 1 as a weighted mean of the share of its 
+		cells that are text (scaled by how full the row is), the share of its 
+		cells that are in the header vocabulary (only if one was passed), and the 
+		share of its text cells that have numbers or dates in the type_window rows
+		below. The header is the first of the best scoring rows, and the 
+		confidence is the margin between its score and the next best row's score,
+		so it is 0 when rows tie for the best score. Blank rows directly below the header are skipped, and the 
+		data end on the row before the next empty or end_values row. If there are
+		no data below the header the end row equals the header row.
+		"""
+		text = kinds == 1
+		filled = kinds > 0
+		sheet_count, row_count, col_count = kinds.shape
+		filled_count = filled.sum(axis = 2).astype(float)
+		text_count = text.sum(axis = 2).astype(float)
+		widest = np.maximum(filled_count.max(axis = 1), 1)[:, None]
+		density = text_count / np.maximum(filled_count, 1) * filled_count / widest
+		
+		numbers = np.cumsum(kinds == 2, axis = 1)
+		numbers = np.concatenate([np.zeros((sheet_count, 1, col_count)), numbers,
+								  np.repeat(numbers[:, -1:], self.type_window, axis = 1)], axis = 1)
+		below = (numbers[:, 1 + self.type_window:row_count + 1 + self.type_window] - 
+				 numbers[:, 1:row_count + 1]) / float(self.type_window)
+		type_change = (text * below).sum(axis = 2) / np.maximum(text_count, 1)
+		
+		if self.header_vocabulary:
+			vocabulary = known.sum(axis = 2) / np.maximum(filled_count, 1)
+			scores = 0.3 * density + 0.4 * vocabulary + 0.3 * type_change
+		else:
+			scores = 0.5 * density + 0.5 * type_change
+		scores = scores[:, :self.header_rows]
+		
+		sheet_index = np.arange(sheet_count)
+		header = scores.argmax(axis = 1)
+		best = scores[sheet_index, header]
+		if self.header_rows > 1:
+			others = scores.copy()
+			others[sheet_index, header] = -np.inf
+			confidence = best - others.max(axis = 1)
+		else:
+			confidence = best
+		
+		rows = np.arange(row_count)[None, :]
+		row_filled = filled.any(axis = 2)
+		row_ends = ends.any(axis = 2)
+		data = row_filled & ~row_ends & (rows > header[:, None])
+		first_data = np.where(data.any(axis = 1), data.argmax(axis = 1), row_count)
+		stop = (~row_filled | row_ends) & (rows > first_data[:, None])
+		last_filled = row_count - 1 - row_filled[:, ::-1].argmax(axis = 1)
+		end = np.where(stop.any(axis = 1), stop.argmax(axis = 1) - 1, last_filled)
+		end = np.where(data.any(axis = 1), end, header)
+		confidence = np.where(best > 0, confidence, 0)
+		return header, end, confidence, best
+		
+	def detect_all_points(self, min_confidence = 0.0):
+		"""
+		min_confidence	: float
+		return		: tuple of dicts
+		method		: visible
+		
+		Returns tuple of three dicts, each with one key for each sheet in workbook:
+		the header row, the last row of data, and the confidence (0 to 1) of the
+		header row. Rows are 1 based, as in FindPoints.\n
+		Every sheet is read once and then all sheets are scored together. Where
+		rows tie for the best score the first of them is used as the header and
+		its confidence is 0. If no row scores above zero, or the confidence is 
+		below min_confidence, the keys of the first two dicts map to a string 
+		value notifying the user that the point was not found, as does the key of
+		the end row dict if there are no data below the header. The first two dicts can then be checked and
+		passed on in the same way as those created by FindPoints.
+		"""
+		sheets = all_sheets()
+		classified = []
+		for sheet in sheets:
+			active_sheet(sheet)
+			classified.append(self.__classify(self.__read_block()))
+		kinds, known, ends = [np.array(arrays) for arrays in zip(*classified)]
+		header, end, confidence, best = self.__score(kinds, known, ends)
+		
+		start_row_dict = {sheet : object() for sheet in sheets}
+		end_row_dict = {sheet : object() for sheet in sheets}
+		confidence_dict = {sheet : object() for sheet in sheets}
+		for x, sheet in enumerate(sheets):
+			confidence_dict[sheet] = round(float(confidence[x]), 3)
+			if best[x] <= 0 or confidence[x] < min_confidence:
+				start_row_dict[sheet] = 'Point Not Found'
+				end_row_dict[sheet] = 'Point Not Found'
+				continue
+			start_row_dict[sheet] = int(header[x]) + 1
+			if end[x] > header[x]:
+				end_row_dict[sheet] = int(end[x]) + 1
+			else:
+				end_row_dict[sheet] = 'Point Not Found'
+		return start_row_dict, end_row_dict, confidence_dict
+
+		
+_MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_PKG_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+_CELL = re.compile(r'<c\b([^>]*?)(/>|>(.*?)</c>)', re.S)
+_STYLE_ATTR = re.compile(r'\ss="(\d+)"')
+_ROW_COL_STYLE = re.compile(r'(<(?:row\b[^>]*?\ss|col\b[^>]*?\sstyle)=")(\d+)"')
+_CELL_METADATA = re.compile(r'\s[cv]m="\d+"')
+_SHARED_TYPE = re.compile(r'\st="s"')
+_SHARED_VALUE = re.compile(r'<v>(\d+)</v>')
+_SHARED_STRING = re.compile(r'<si>(.*?)</si>|<si/>', re.S)
+_SHEET_RELS = [(re.compile(r'<(hyperlinks|oleObjects|controls|tableParts|extLst)\b[^>]*?(?<!/)>.*?</\1>', re.S), ''),
+			   (re.compile(r'<(drawing|legacyDrawing|legacyDrawingHF|picture|hyperlinks|tableParts)\b[^>]*/>'), ''),
+			   (re.compile(r'(<[^>]*?)\s\w+:id="[^"]*"'), r'\1'),
+			   (re.compile(r'\stabSelected="1"'), '')]
+_PREFIXED_ROOT = re.compile(r'(?:\xef\xbb\xbf)?\s*(?:<\?xml[^>]*\?>\s*)?<\w+:')
+_CONDITIONAL_FORMATS = re.compile(r'<conditionalFormatting\b.*?</conditionalFormatting>', re.S)
+_CELL_REF = re.compile(r'([A-Z]+)(\d+)')
+_DATE_FORMAT_IDS = set(range(14, 23) + range(45, 48))
+_DATE_FORMAT_CODE = re.compile(r'[dmyhs]', re.I)
+_FORMAT_LITERALS = re.compile(r'"[^"]*"|\[[^\]]*\]|\\.')
+_READERS = {}
+_DEFAULT_STYLES = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+				   '<styleSheet xmlns="' + _MAIN_NS + '">'
+				   '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+				   '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+				   '<fill><patternFill patternType="gray125"/></fill></fills>'
+				   '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+				   '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+				   '<cellXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/></cellXfs>'
+				   '</styleSheet>')
+
+def _xlsx_sheet_parts(source_zip):
+	"""
+	source_zip	: zipfile.ZipFile
+	return		: list of tuples
+	method		: hidden
+	
+	Returns list of (sheet name, part name) tuples, in workbook order, for every
+	worksheet in the .xlsx file open as source_zip. Read from the workbook and
+	workbook relationship manifests, so no Excel process is needed.
+	"""
+	workbook = ET.fromstring(source_zip.read('xl/workbook.xml'))
+	rels = ET.fromstring(source_zip.read('xl/_rels/workbook.xml.rels'))
+	targets = {rel.get('Id') : rel.get('Target') for rel in rels 
+			   if rel.get('Type').endswith('/worksheet')}
+	sheet_parts = []
+	for sheet in workbook.iter('{%s}sheet' % _MAIN_NS):
+		target = targets.get(sheet.get('{%s}id' % _REL_NS))
+		if not target:
+			continue
+		if target.startswith('/'):
+			part = target[1:]
+		else:
+			part = posixpath.normpath(posixpath.join('xl', target))
+		sheet_parts.append((sheet.get('name'), part))
+	return sheet_parts
+
+def _xlsx_date1904(source_zip):
+	"""
+	source_zip	: zipfile.ZipFile
+	return		: bool
+	method		: hidden
+	
+	Returns True if the .xlsx file open as source_zip uses the 1904 date system.
+	"""
+	workbook = ET.fromstring(source_zip.read('xl/workbook.xml'))
+	properties = workbook.find('{%s}workbookPr' % _MAIN_NS)
+	if properties is None:
+		return False
+	return properties.get('date1904', 'false').lower() in ('1', 'true')
+
+class _XlsxReader:
+	def __init__(self, workbook_path):
+		"""
+		workbook_path	: string
+		
+		Hidden class for reading cell values from the sheets of a saved .xlsx
+		workbook without Excel or DataNitro. The sheet manifest, shared strings 
+		and date formats are read once when the class is initialised. Each call to
+		sheet_values() opens the file again, so one reader can be shared by many
+		threads.
+		"""
+		self.workbook_path = workbook_path
+		with zipfile.ZipFile(workbook_path) as source_zip:
+			self.__sheet_parts = dict(_xlsx_sheet_parts(source_zip))
+			self.sheet_names = [name for name, part in _xlsx_sheet_parts(source_zip)]
+			self.__epoch = (datetime.datetime(1904, 1, 1) if _xlsx_date1904(source_zip)
+							else datetime.datetime(1899, 12, 30))
+			self.__shared_strings = self.__read_shared_strings(source_zip)
+			self.__date_styles = self.__read_date_styles(source_zip)
+			
+	def __read_shared_strings(self, source_zip):
+		"""
+		source_zip	: zipfile.ZipFile
+		return		: list
+		method		: hidden
+		
+		Returns list of the text of every shared string in source_zip.
+		"""
+		try:
+			sst = ET.fromstring(source_zip.read('xl/sharedStrings.xml'))
+		except KeyError:
+			return []
+		text, run = '{%s}t' % _MAIN_NS, '{%s}r' % _MAIN_NS
+		return [''.join([node.text or '' for node in si.findall(text)] + 
+						[node.text or '' for node in si.findall(run + '/' + text)])
+				for si in sst]
+		
+	def __read_date_styles(self, source_zip):
+		"""
+		source_zip	: zipfile.ZipFile
+		return		: set
+		method		: hidden
+		
+		Returns set of the cell format indices in source_zip that format numbers
+		as dates or times.
+		"""
+		try:
+			styles = ET.fromstring(source_zip.read('xl/styles.xml'))
+		except KeyError:
+			return set()
+		custom_dates = set(fmt.get('numFmtId') for fmt in styles.iter('{%s}numFmt' % _MAIN_NS)
+						   if _DATE_FORMAT_CODE.search(_FORMAT_LITERALS.sub('', fmt.get('formatCode'))))
+		cell_xfs = styles.find('{%s}cellXfs' % _MAIN_NS)
+		return set(index for index, xf in enumerate(cell_xfs if cell_xfs is not None else [])
+				   if int(xf.get('numFmtId', 0)) in _DATE_FORMAT_IDS 
+				   or xf.get('numFmtId') in custom_dates)
+		
+	def __cell_value(self, cell):
+		"""
+		cell	: ElementTree.Element
+		return	: value or None
+		method	: hidden
+		
+		Returns the value of cell as DataNitro would read it: text as strings, 
+		numbers in date formats as datetime.datetime objects, whole numbers as
+		integers and booleans as bool.
+		"""
+		cell_type = cell.get('t', 'n')
+		if cell_type == 'inlineStr':
+			return ''.join(node.text or '' for node in cell.iter('{%s}t' % _MAIN_NS))
+		value = cell.findtext('{%s}v' % _MAIN_NS)
+		if value is None:
+			return None
+		if cell_type == 's':
+			return self.__shared_strings[int(value)]
+		if cell_type == 'b':
+			return value == '1'
+		if cell_type in ('str', 'e'):
+			return value
+		number = float(value)
+		if int(cell.get('s', 0)) in self.__date_styles:
+			return self.__epoch + datetime.timedelta(seconds = round(number * 86400))
+		if number.is_integer():
+			return int(number)
+		return number
+		
+	def sheet_values(self, sheet_name, max_row = None):
+		"""
+		sheet_name	: string
+		max_row		: None or int
+		return		: dict
+		method		: visible
+		
+		Returns dict of (row, col) keys and the values of the non-empty cells on
+		sheet_name, reading no further than max_row if it is passed.
+		"""
+		values = {}
+		row, col = 0, 0
+		row_tag, cell_tag = '{%s}row' % _MAIN_NS, '{%s}c' % _MAIN_NS
+		with zipfile.ZipFile(self.workbook_path) as source_zip:
+			part = source_zip.open(self.__sheet_parts[sheet_name])
+			for event, element in ET.iterparse(part, events = ('start', 'end')):
+				if element.tag == row_tag and event == 'start':
+					row = int(element.get('r', row + 1))
+					col = 0
+					if max_row and row > max_row:
+						break
+				elif element.tag == cell_tag and event == 'end':
+					ref = _CELL_REF.match(element.get('r', ''))
+					if ref:
+						col = reduce(lambda total, letter: total * 26 + ord(letter) - 64,
+									 ref.group(1), 0)
+					else:
+						col += 1
+					value = self.__cell_value(element)
+					if value is not None:
+						values[(row, col)] = value
+					element.clear()
+				elif element.tag == row_tag:
+					element.clear()
+		return values
+
+def _xlsx_reader(workbook_path):
+	"""
+	workbook_path	: string
+	return			: _XlsxReader
+	method			: hidden
+	
+	Returns the _XlsxReader for workbook_path. One reader is kept per path in each
+	process, and it is replaced when the modification time or size of the file 
+	changes, i.e. when the workbook has been saved again.
+	"""
+	stat = os.stat(workbook_path)
+	version = (stat.st_mtime, stat.st_size)
+	if workbook_path not in _READERS or _READERS[workbook_path][0] != version:
+		_READERS[workbook_path] = (version, _XlsxReader(workbook_path))
+	return _READERS[workbook_path][1]
+
+def _sheet_task(task):
+	"""
+	task	: tuple
+	return	: tuple
+	method	: hidden
+	
+	Worker for _map_sheets(). task is a tuple of a class object, the name of one
+	of its methods, workbook_path, sheet name, a tuple of arguments and max_row.
+	Reads the sheet values from file and returns tuple of the sheet name, whether
+	the method succeeded, and the result of calling the method with the 
+	arguments and the values. Defined at module level so that process pools can
+	pickle it.
+	"""
+	class_object, method_name, workbook_path, sheet, args, max_row = task
+	values = _xlsx_reader(workbook_path).sheet_values(sheet, max_row)
+	try:
+		return sheet, True, getattr(class_object, method_name)(*args, values = values)
+	except _NotFoundError:
+		return sheet, False, None
+
+def _map_sheets(class_object, method_name, workbook_path, executor = None, 
+				sheet_args = None, max_row = None):
+	"""
+	class_object	: class object
+	method_name		: string
+	workbook_path	: string
+	executor		: None or object with a map method
+	sheet_args		: None or dict
+	max_row			: None or int
+	return			: list of tuples
+	method			: hidden
+	
+	Returns list of the (sheet, succeeded, result) tuples created by _sheet_task()
+	for every sheet in the workbook saved at workbook_path, in sheet order. The
+	sheets are read and processed by executor.map() if an executor is passed 
+	(e.g. a multiprocessing.pool.ThreadPool, multiprocessing.Pool or 
+	concurrent.futures executor), otherwise one after the other. sheet_args is
+	an optional dict of sheet names and tuples of arguments for each sheet.
+	"""
+	if not isinstance(workbook_path, str):
+		raise _InputError("workbook_path must be a string when reading sheets from file")
+	sheets = _xlsx_reader(workbook_path).sheet_names
+	tasks = [(class_object, method_name, workbook_path, sheet, 
+			  (sheet_args or {}).get(sheet, ()), max_row) for sheet in sheets]
+	if executor is None:
+		return map(_sheet_task, tasks)
+	return list(executor.map(_sheet_task, tasks))
+
+class _SheetTransplanter:
+	def __init__(self, new_file_name):
+		"""
+		new_file_name	: string
+		
+		Hidden class that writes worksheets copied directly from the XML parts of
+		.xlsx files to a new .xlsx file at new_file_name.\n
+		Each sheet part is written to the output as soon as it is added, so memory
+		use does not grow with the number of sheets. Shared strings are remapped to
+		a single output table, and cell styles are only remapped when a source 
+		workbook's styles differ from those already in the output. The workbook 
+		and relationship manifests are written once when close() is called.\n
+		Cell values, formulas, cell formats, merges and sheet layout are copied.
+		Parts the sheet refers to by relationship (drawings, comments, tables) are
+		dropped, as are all hyperlinks (internal and external) and the sheet's 
+		extension list (which holds newer data validations, conditional formats 
+		and sparklines). Conditional formatting is also dropped on every sheet 
+		whose styles part differs from the first one compiled. The 
+		dropped_conditional_formats attribute lists the output sheets that lost
+		conditional formatting.
+		"""
+		self.__zip = zipfile.ZipFile(new_file_name, 'w', zipfile.ZIP_DEFLATED, True)
+		self.__sheet_names = []
+		self.__taken_names = set()
+		self.__shared_index = {}
+		self.__shared_strings = []
+		self.__styles = None
+		self.__styles_tree = None
+		self.__style_index = {}
+		self.__style_maps = {}
+		self.__date1904 = None
+		self.dropped_conditional_formats = []
+		
+	def __shared_map(self, source_zip):
+		"""
+		source_zip	: zipfile.ZipFile
+		return		: function
+		method		: hidden
+		
+		Returns function that maps a shared string index in source_zip to an index
+		in the output shared string table, adding the string to the output table
+		the first time it is used.
+		"""
+		try:
+			sst = source_zip.read('xl/sharedStrings.xml')
+		except KeyError:
+			sst = ''
+		source_strings = [match.group(1) or '' for match in _SHARED_STRING.finditer(sst)]
+		def shared_map(index):
+			raw = source_strings[index]
+			if raw not in self.__shared_index:
+				self.__shared_index[raw] = len(self.__shared_strings)
+				self.__shared_strings.append(raw)
+			return self.__shared_index[raw]
+		return shared_map
+	
+	def __merge_style_element(self, tag, element):
+		"""
+		tag		: string
+		element	: ElementTree.Element
+		return	: int
+		method	: hidden
+		
+		Returns index of element in the tag collection (fonts, fills, borders or 
+		cellXfs) of the output styles, appending element if it is not already 
+		there.
+		"""
+		collection = self.__styles_tree.find('{%s}%s' % (_MAIN_NS, tag))
+		if tag not in self.__style_index:
+			self.__style_index[tag] = {}
+			for index, child in enumerate(collection):
+				child.tail = None
+				self.__style_index[tag].setdefault(ET.tostring(child), index)
+		element.tail = None
+		key = ET.tostring(element)
+		if key not in self.__style_index[tag]:
+			self.__style_index[tag][key] = len(collection)
+			collection.append(element)
+			collection.set('count', str(len(collection)))
+		return self.__style_index[tag][key]
+	
+	def __merge_styles(self, styles):
+		"""
+		styles	: string
+		return	: list
+		method	: hidden
+		
+		Merges the number formats, fonts, fills, borders and cell formats of the 
+		source styles part into the output styles, and returns list that maps each
+		source cell format index to its index in the output styles.
+		"""
+		if self.__styles_tree is None:
+			for prefix, uri in [('', _MAIN_NS), ('r', _REL_NS),
+								('mc', 'http://schemas.openxmlformats.org/markup-compatibility/2006'),
+								('x14ac', 'http://schemas.microsoft.com/office/spreadsheetml/2009/9/ac'),
+								('x16r2', 'http://schemas.microsoft.com/office/spreadsheetml/2015/02/main'),
+								('xr', 'http://schemas.microsoft.com/office/spreadsheetml/2014/revision')]:
+				ET.register_namespace(prefix, uri)
+			self.__styles_tree = ET.fromstring(self.__styles or _DEFAULT_STYLES)
+			self.__styles_tree.attrib.pop(
+				'{http://schemas.openxmlformats.org/markup-compatibility/2006}Ignorable', None)
+		source = ET.fromstring(styles)
+		
+		num_fmts = self.__styles_tree.find('{%s}numFmts' % _MAIN_NS)
+		if num_fmts is None:
+			num_fmts = ET.Element('{%s}numFmts' % _MAIN_NS)
+			self.__styles_tree.insert(0, num_fmts)
+		format_codes = {fmt.get('formatCode') : int(fmt.get('numFmtId')) for fmt in num_fmts}
+		fmt_map = {}
+		for fmt in source.iter('{%s}numFmt' % _MAIN_NS):
+			code = fmt.get('formatCode')
+			if code not in format_codes:
+				format_codes[code] = max(format_codes.values() + [163]) + 1
+				ET.SubElement(num_fmts, '{%s}numFmt' % _MAIN_NS, 
+							  numFmtId = str(format_codes[code]), formatCode = code)
+				num_fmts.set('count', str(len(num_fmts)))
+			fmt_map[fmt.get('numFmtId')] = str(format_codes[code])
+		
+		id_maps = {}
+		for attr, tag in [('fontId', 'fonts'), ('fillId', 'fills'), ('borderId', 'borders')]:
+			collection = source.find('{%s}%s' % (_MAIN_NS, tag))
+			id_maps[attr] = [str(self.__merge_style_element(tag, element)) 
+							 for element in (collection if collection is not None else [])]
+		
+		xf_map = []
+		cell_xfs = source.find('{%s}cellXfs' % _MAIN_NS)
+		for xf in (cell_xfs if cell_xfs is not None else []):
+			for attr, ids in id_maps.iteritems():
+				if xf.get(attr) is not None:
+					index = int(xf.get(attr))
+					xf.set(attr, ids[index] if index < len(ids) else '0')
+			if xf.get('numFmtId') in fmt_map:
+				xf.set('numFmtId', fmt_map[xf.get('numFmtId')])
+			xf.set('xfId', '0')
+			xf_map.append(self.__merge_style_element('cellXfs', xf))
+		return xf_map
+	
+	def __style_map(self, source_zip):
+		"""
+		source_zip	: zipfile.ZipFile
+		return		: list or None
+		method		: hidden
+		
+		Returns None if the cell formats of source_zip can be used unchanged in the
+		output, otherwise the list that maps them to output cell format indices.
+		The first styles part seen becomes the output styles, and each distinct 
+		styles part is only merged once.
+		"""
+		try:
+			styles = source_zip.read('xl/styles.xml')
+		except KeyError:
+			return None
+		if self.__styles is None and self.__styles_tree is None:
+			self.__styles = styles
+			return None
+		if styles == self.__styles:
+			return None
+		digest = hashlib.sha1(styles).hexdigest()
+		if digest not in self.__style_maps:
+			self.__style_maps[digest] = self.__merge_styles(styles)
+		return self.__style_maps[digest]
+	
+	def __unique_name(self, sheet_name):
+		"""
+		sheet_name	: string
+		return		: string
+		method		: hidden
+		
+		Returns sheet_name, or sheet_name with a random suffix if a sheet of that
+		name is already in the output.
+		"""
+		new_name = sheet_name
+		while new_name.lower() in self.__taken_names:
+			new_name = sheet_name[:23] + str(random.randint(1, 10000000))
+		return new_name
+		
+	def add_sheet(self, source_zip, part, sheet_name):
+		"""
+		source_zip	: zipfile.ZipFile
+		part		: string
+		sheet_name	: string
+		return		: string
+		method		: visible
+		
+		Copies the worksheet part of source_zip to the output as the next sheet,
+		remapping shared strings and cell, row and column styles where needed, and
+		returns the name the sheet was given in the output. Cell and value metadata
+		references are dropped as metadata.xml is not copied.\n
+		Raises _InputError if source_zip does not use the same date system as the
+		sheets already in the output, or if its sheet, shared strings or styles 
+		part is written with a namespace prefix (e.g. <x:worksheet>), which the 
+		part rewriting does not support.
+		"""
+		date1904 = _xlsx_date1904(source_zip)
+		if self.__date1904 is None:
+			self.__date1904 = date1904
+		elif date1904 != self.__date1904:
+			raise _InputError("different date system to the first file compiled")
+		for prefix_part in [part, 'xl/sharedStrings.xml', 'xl/styles.xml']:
+			try:
+				root = source_zip.open(prefix_part).read(512)
+			except KeyError:
+				continue
+			if _PREFIXED_ROOT.match(root):
+				raise _InputError("namespace prefixed XML is not supported")
+		
+		sheet_xml = source_zip.read(part)
+		conditional_formats = 'conditionalFormatting' in sheet_xml
+		style_map = self.__style_map(source_zip)
+		shared_map = self.__shared_map(source_zip)
+		def map_style(index):
+			index = int(index)
+			return style_map[index] if index < len(style_map) else 0
+		def rewrite_cell(match):
+			attrs = _CELL_METADATA.sub('', match.group(1))
+			if style_map is not None:
+				attrs = _STYLE_ATTR.sub(lambda m: ' s="%d"' % map_style(m.group(1)), attrs)
+			if match.group(3) is None:
+				return '<c' + attrs + '/>'
+			body = match.group(3)
+			if _SHARED_TYPE.search(attrs):
+				body = _SHARED_VALUE.sub(lambda m: '<v>%d</v>' % shared_map(int(m.group(1))), body)
+			return '<c' + attrs + '>' + body + '</c>'
+		if style_map is not None or 't="s"' in sheet_xml or 'm="' in sheet_xml:
+			sheet_xml = _CELL.sub(rewrite_cell, sheet_xml)
+		if style_map is not None:
+			sheet_xml = _ROW_COL_STYLE.sub(lambda m: '%s%d"' % (m.group(1), map_style(m.group(2))),
+										   sheet_xml)
+			sheet_xml = _CONDITIONAL_FORMATS.sub('', sheet_xml)
+		for pattern, replacement in _SHEET_RELS:
+			sheet_xml = pattern.sub(replacement, sheet_xml)
+		
+		new_name = self.__unique_name(sheet_name)
+		self.__sheet_names.append(new_name)
+		self.__taken_names.add(new_name.lower())
+		if conditional_formats and 'conditionalFormatting' not in sheet_xml:
+			self.dropped_conditional_formats.append(new_name)
+		self.__zip.writestr('xl/worksheets/sheet%d.xml' % len(self.__sheet_names), sheet_xml)
+		return new_name
+		
+	def close(self):
+		"""
+		return	: None
+		method	: visible
+		
+		Writes the shared strings, styles, workbook and relationship manifests
+		and closes the output file.
+		"""
+		count = len(self.__sheet_names)
+		sheet_types = ''.join(['<Override PartName="/xl/worksheets/sheet%d.xml" ContentType='
+							   '"application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+							   % x for x in xrange(1, count + 1)])
+		self.__zip.writestr('[Content_Types].xml', 
+			'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+			'<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+			'<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+			'<Default Extension="xml" ContentType="application/xml"/>'
+			'<Override PartName="/xl/workbook.xml" ContentType='
+			'"application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>' + sheet_types +
+			'<Override PartName="/xl/styles.xml" ContentType='
+			'"application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+			'<Override PartName="/xl/sharedStrings.xml" ContentType='
+			'"application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+			'</Types>')
+		self.__zip.writestr('_rels/.rels', 
+			'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+			'<Relationships xmlns="' + _PKG_NS + '">'
+			'<Relationship Id="rId1" Type="' + _REL_NS + '/officeDocument" Target="xl/workbook.xml"/>'
+			'</Relationships>')
+		
+		sheets = u''.join([u'<sheet name=%s sheetId="%d" r:id="rId%d"/>' % (quoteattr(name), x, x)
+						   for x, name in enumerate(self.__sheet_names, 1)])
+		self.__zip.writestr('xl/workbook.xml', (
+			u'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+			u'<workbook xmlns="' + _MAIN_NS + u'" xmlns:r="' + _REL_NS + u'">' +
+			(u'<workbookPr date1904="1"/>' if self.__date1904 else u'') +
+			u'<bookViews><workbookView/></bookViews><sheets>' + sheets + 
+			u'</sheets></workbook>').encode('utf-8'))
+		sheet_rels = ''.join(['<Relationship Id="rId%d" Type="%s/worksheet" '
+							  'Target="worksheets/sheet%d.xml"/>' % (x, _REL_NS, x)
+							  for x in xrange(1, count + 1)])
+		self.__zip.writestr('xl/_rels/workbook.xml.rels', 
+			'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+			'<Relationships xmlns="' + _PKG_NS + '">' + sheet_rels +
+			'<Relationship Id="rId%d" Type="%s/styles" Target="styles.xml"/>' % (count + 1, _REL_NS) +
+			'<Relationship Id="rId%d" Type="%s/sharedStrings" Target="sharedStrings.xml"/>' 
+			% (count + 2, _REL_NS) + '</Relationships>')
+		
+		if self.__styles_tree is not None:
+			styles = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n' + 
+					  ET.tostring(self.__styles_tree))
+		else:
+			styles = self.__styles or _DEFAULT_STYLES
+		self.__zip.writestr('xl/styles.xml', styles)
+		self.__zip.writestr('xl/sharedStrings.xml', 
+			'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+			'<sst xmlns="%s" count="%d" uniqueCount="%d">' % (_MAIN_NS, len(self.__shared_strings),
+															  len(self.__shared_strings)) +
+			''.join(['<si>%s</si>' % (raw or '<t/>') for raw in self.__shared_strings]) + '</sst>')
+		self.__zip.close()
+		return
+
 class sheet_compiler:
 	def __init__(self, top_folderpath, **kwargs):
 		"""
@@ -515,7 +1560,11 @@ class sheet_compiler:
 
 		Initialise the class by passing a string of the top_folderpath where the
 		compiled workbook will be stored, and a number of arguments of the format
-		folder1 = r'Path/To/Folder
+		folder1 = r'Path/To/Folder\n
+		
+		The provenance_dict attribute is filled by compile_sheets() and has one key
+		for each compiled sheet name, with values that are dicts of the source 
+		folder, folder_path, file, source_sheet and compiled_sheet.
 		"""
 		if not isinstance(top_folderpath, str):
 			raise _InputError("top_folderpath must be a raw string")
@@ -523,6 +1572,7 @@ class sheet_compiler:
 		if len(kwargs) < 1:
 			raise _InputError('Specify at least one kwarg (folder path)')
 		self.file_dict = kwargs
+		self.provenance_dict = {}
 		
 	def get_file_list_dict(self):
 		"""
@@ -551,7 +1601,20 @@ class sheet_compiler:
 		workbook.
 		"""
 		active_wkbk(filename)
-		sheets = all_sheets()
+		return self.__select_sheet(all_sheets(), sub_string1, sub_string2)
+		
+	def __select_sheet(self, sheets, sub_string1, sub_string2 = None):
+		"""
+		sheets		: list
+		sub_string1	: string
+		sub_string2	: string
+		return		: string
+		method		: hidden
+		
+		Returns the sheet name in sheets that contains sub_string1 and optionally 
+		sub_string2 if provided as argument. Raises exception if the arguments do 
+		not uniquely identify a single sheet.
+		"""
 		if sub_string2:
 			selected_sheets = [sheet for sheet in sheets if sub_string1.lower() in
 							   sheet.lower() and sub_string2.lower() in sheet.lower()]
@@ -578,23 +1641,43 @@ class sheet_compiler:
 		copy_sheet(to_workbook, sheet_name)
 		return
 
-	def __save_to_json(self, file_list_dict):
+	def __save_to_json(self, file_list_dict, prefix = 'final_file_list_dict_'):
 		"""
 		file_list_dict	: dict
-		filename		: string (including .json extension
+		prefix			: string
 		returns			: none
 		method:			hidden
 		
 		Function saves object passed as file_list_dict to json in self.top_folderpath.
 		Could be any object in fact, but designed to save the file_list_dict such
-		as that created by the get_file_dict() method.\n
+		as that created by the get_file_dict() method. The file is named prefix + 
+		today's date.\n
 		Function to be called in compile_sheets() method below
 		"""
 		os.chdir(self.top_folderpath)
-		with open('final_file_list_dict_' + str(datetime.datetime.now().date()) + '.json', 'w') as out_file:
+		with open(prefix + str(datetime.datetime.now().date()) + '.json', 'w') as out_file:
 			json.dump(file_list_dict, out_file)
 		return
 		
+	def __record_provenance(self, folder, filename, source_sheet, compiled_sheet):
+		"""
+		folder			: string
+		filename		: string
+		source_sheet	: string
+		compiled_sheet	: string
+		return			: None
+		method			: hidden
+		
+		Adds entry to self.provenance_dict under the compiled_sheet key recording
+		the folder and file the sheet was copied from, and its original name.
+		"""
+		self.provenance_dict[compiled_sheet] = {'folder' : folder,
+												'folder_path' : self.file_dict[folder],
+												'file' : filename,
+												'source_sheet' : source_sheet,
+												'compiled_sheet' : compiled_sheet}
+		return
+		
 	def compile_sheets(self, file_list_dict, new_wkbk_name, sub_string1, sub_string2 = None):
 		"""
 		file_dict		: list
@@ -613,10 +1696,14 @@ class sheet_compiler:
 		Sheets that are successfully identified for copying will be copied to a new
 		workbook created according to new_wkbk_name. This workbook will be in the
 		top_folderpath directory. \n
-		Files are opened in the reverse order they are found in the file_dict.
+		Files are opened in the reverse order they are found in the file_dict.\n
+		Every sheet copied is recorded in self.provenance_dict, which is also saved
+		to json in the top_folderpath. Pass it to Dates.compare_cell_file_date() and
+		rename_sheets() so that sheets can still be traced to their source files.
 		"""
 		
 		self.__save_to_json(file_list_dict) #Note __save to json call
+		self.provenance_dict = {}
 		unsuccessful = []
 		new_book = new_wkbk()
 		new_file_name = self.top_folderpath + '\\' + new_wkbk_name
@@ -635,17 +1722,20 @@ class sheet_compiler:
 					sheet_name = self.__get_sheet(filename, sub_string1, sub_string2)
 					try:
 						self.__relocate_sheet(filename, new_wkbk_name, sheet_name)
+						self.__record_provenance(folder, filename, sheet_name, sheet_name)
 					except NitroException:
 						new_name = sheet_name + str(random.randint(1, 10000000))
 						rename_sheet(sheet_name, new_name)
 						try:
 							self.__relocate_sheet(filename, new_wkbk_name, new_name)
+							self.__record_provenance(folder, filename, sheet_name, new_name)
 						except NitroException:
 							unsuccessful.append(filename)		
 				except _NotFoundError:
 					unsuccessful.append(filename)
 				close_wkbk(filename)
 			active_wkbk(new_wkbk_name)
+		self.__save_to_json(self.provenance_dict, 'provenance_dict_')
 		
 		if not unsuccessful:
 			message = "Compile successful for all files in filelist"
@@ -658,6 +1748,93 @@ class sheet_compiler:
 					  """
 			return message
 			
+	def compile_sheets_xml(self, file_list_dict, new_wkbk_name, sub_string1, sub_string2 = None):
+		"""
+		file_list_dict	: dict
+		new_wkbk_name	: string (.xlsx)
+		sub_string1		: string
+		sub_string2		: string or None
+		return			: formatted string
+		method			: visible
+		
+		File-level alternative to compile_sheets() for .xlsx workbooks that does 
+		not need Excel or DataNitro. Returns formatted string that gives report to
+		user as to success of the compile operation.\n
+		The sheet identified by sub_string1 and optionally sub_string2 in each file
+		is found from the workbook manifest, and its XML part is copied directly 
+		from the source file into the new workbook created according to 
+		new_wkbk_name in the top_folderpath directory. Shared strings and styles 
+		are remapped only where needed, and the workbook manifests are written once
+		at the end, so only one sheet is held in memory at a time.\n
+		Cell values, formulas, cell formats, merges and sheet layout are copied.
+		Drawings, comments, tables, all hyperlinks (including links within the 
+		workbook) and the sheet extension list (newer data validations, 
+		conditional formats and sparklines) are dropped. Conditional formatting 
+		is also dropped from every sheet whose workbook styles differ from those 
+		of the first file compiled, and the sheets that lost conditional 
+		formatting are listed in the returned report. Files that
+		are not .xlsx files (e.g. .xls), where the sheet is not uniquely identified,
+		that use a different date system to the first file compiled, whose XML is
+		written with namespace prefixes (e.g. <x:c>), or whose parts cannot be 
+		read are reported as unsuccessful along with the reason. The new
+		workbook is always closed, even if the compile is interrupted.\n
+		Sheets are added in the order they are found in the file_list_dict, and 
+		recorded in self.provenance_dict exactly as in compile_sheets().
+		"""
+		self.__save_to_json(file_list_dict)
+		self.provenance_dict = {}
+		unsuccessful = []
+		transplanter = _SheetTransplanter(os.path.join(self.top_folderpath, new_wkbk_name))
+		folders = file_list_dict.keys()
+		folders.sort()
+		
+		try:
+			for folder in folders:
+				for filename in file_list_dict[folder]:
+					try:
+						source_zip = zipfile.ZipFile(os.path.join(self.file_dict[folder], filename))
+					except (IOError, zipfile.BadZipfile):
+						unsuccessful.append((filename, 'not an .xlsx file'))
+						continue
+					try:
+						sheet_parts = dict(_xlsx_sheet_parts(source_zip))
+						sheet_name = self.__select_sheet(sheet_parts.keys(), sub_string1, sub_string2)
+						new_name = transplanter.add_sheet(source_zip, sheet_parts[sheet_name], sheet_name)
+						self.__record_provenance(folder, filename, sheet_name, new_name)
+					except _NotFoundError:
+						unsuccessful.append((filename, 'sheet not uniquely identified'))
+					except _InputError as error:
+						unsuccessful.append((filename, error.value))
+					except (KeyError, ET.ParseError):
+						unsuccessful.append((filename, 'workbook parts missing or unreadable'))
+					except (IndexError, ValueError):
+						unsuccessful.append((filename, 'sheet refers to missing shared strings or styles'))
+					finally:
+						source_zip.close()
+		finally:
+			transplanter.close()
+		self.__save_to_json(self.provenance_dict, 'provenance_dict_')
+		
+		if not unsuccessful:
+			message = "Compile successful for all files in filelist"
+		else:
+			message = """
+					  Compile was unsuccessful for the following files:
+
+					  {}
+					  """
+			message = message.format('\n\t\t\t\t\t  '.join(['{} : {}'.format(filename, reason) 
+												for filename, reason in unsuccessful]))
+		if transplanter.dropped_conditional_formats:
+			dropped_message = """
+					  Conditional formatting was dropped from the following sheets:
+
+					  {}
+					  """
+			message += dropped_message.format('\n\t\t\t\t\t  '.join(
+											  transplanter.dropped_conditional_formats))
+		return message
+			
 class workbook_structure:
 	def __init__(self, Dates_class_object, start_row_dict, end_row_dict, cols_list):
 		"""
@@ -721,18 +1898,27 @@ class workbook_structure:
 		return "Save complete"
 		
 
-def rename_sheets(prefix):
+def rename_sheets(prefix, provenance_dict = None, top_folderpath = None):
 	"""
-	suffix 	: string
-	return 	: None
-	method	: visible
+	suffix 			: string
+	provenance_dict	: None or dict (as created when compiling)
+	top_folderpath	: None or string
+	return 			: None
+	method			: visible
 	
-	Renames sheets according to prefix + two digit serial
+	Renames sheets according to prefix + two digit serial. If a provenance_dict
+	is passed, its keys and compiled_sheet values are updated in place to the new
+	sheet names. The provenance_dict_<date>.json saved when compiling is not 
+	changed unless top_folderpath is passed too, in which case the updated 
+	provenance_dict is saved there again.
 	"""
+	if top_folderpath is not None and not isinstance(top_folderpath, str):
+		raise _InputError("top_folderpath must be a string value")
 	sheets = all_sheets()
 	codeList = list(itertools.chain(*[[prefix + '00' + str(x) for x in xrange(1, 10)], 
 									  [prefix + '0' + str(x) for x in xrange(10, 100)],
 									  [prefix + str(x) for x in xrange(100, 181)]]))
+	renames = zip(sheets, codeList)
 	try:
 		for x in xrange(len(sheets)):
 			active_sheet(sheets[x])
@@ -746,6 +1932,16 @@ def rename_sheets(prefix):
 		for x in xrange(len(sheets)):
 			active_sheet(sheets[x])
 			rename_sheet(sheets[x], codeList[x])
+	if provenance_dict is not None:
+		moved = [(new, provenance_dict.pop(old)) for old, new in renames
+				 if old in provenance_dict]
+		for new, entry in moved:
+			entry['compiled_sheet'] = new
+			provenance_dict[new] = entry
+		if top_folderpath is not None:
+			os.chdir(top_folderpath)
+			with open('provenance_dict_' + str(datetime.datetime.now().date()) + '.json', 'w') as out_file:
+				json.dump(provenance_dict, out_file)
 	return		
 
 def unmerge_data(start_row_dict, end_row_dict, cols_list, headers_only = True):